@@ -44,6 +44,7 @@ setup(
     # some requirements are also in requirements*.txt files
     # Its assumed this is installed as a dependency of robottelo, frozen packages are defined there
     install_requires=[
+        'asyncssh',
         'Fabric3',
         'fauxfactory',
         'ovirt-engine-sdk-python',
@@ -1,34 +1,73 @@
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from functools import partial
 
+import asyncssh
 from automation_tools import setup_capsule_firewall
 from fabric.api import execute
 from fabric.api import run
 from fabric.api import settings as fabric_settings
-from robozilla.decorators import bz_bug_is_open
 
 from upgrade.helpers import settings
+from upgrade.helpers.constants.constants import FOREMAN_SERVICE_RESTART
 from upgrade.helpers.constants.constants import RHEL_CONTENTS
-from upgrade.helpers.logger import logger
+from upgrade.helpers.constants.constants import WORKAROUND_1829115
+from upgrade.helpers.logger import get_logger
 from upgrade.helpers.tasks import add_baseOS_repo
-from upgrade.helpers.tasks import capsule_sync
 from upgrade.helpers.tasks import enable_disable_repo
 from upgrade.helpers.tasks import foreman_maintain_package_update
-from upgrade.helpers.tasks import foreman_service_restart
 from upgrade.helpers.tasks import http_proxy_config
 from upgrade.helpers.tasks import nonfm_upgrade
 from upgrade.helpers.tasks import sync_capsule_repos_to_satellite
 from upgrade.helpers.tasks import update_capsules_to_satellite
 from upgrade.helpers.tasks import upgrade_using_foreman_maintain
 from upgrade.helpers.tasks import upgrade_validation
-from upgrade.helpers.tasks import wait_untill_capsule_sync
-from upgrade.helpers.tasks import workaround_1829115
 from upgrade.helpers.tasks import yum_repos_cleanup
+from upgrade.helpers.tools import bz_bug_is_open
+from upgrade.helpers.tools import cache_dns_resolution
 from upgrade.helpers.tools import copy_ssh_key
 from upgrade.helpers.tools import host_pings
 from upgrade.helpers.tools import host_ssh_availability_check
 from upgrade.helpers.tools import reboot
+from upgrade.helpers.tools import run_on
+from upgrade.helpers.tools import run_on_hosts
 
-logger = logger()
+logger = get_logger()
+
+_CAPSULE_REPOS = (RHEL_CONTENTS["tools"]["label"], RHEL_CONTENTS["capsule"]["label"])
+_MAINTENANCE_REPOS = (RHEL_CONTENTS["maintenance"]["label"],)
+
+
+@lru_cache(maxsize=4)
+def _ansible_repo(major_ver, ansible_repo_version):
+    """Returns the ansible repo label of the RHEL major version
+
+    :param str major_ver: RHEL major version e.g '7'
+    :param str ansible_repo_version: ansible version of the repo e.g '2.9'
+    """
+    return f"rhel-{major_ver}-server-ansible-{ansible_repo_version}-rpms"
+
+
+async def _setup_one_capsule(cap_host):
+    """Runs the pre-upgrade tasks on the capsule
+
+    :param str cap_host: Capsule hostname to run the tasks on
+    :returns bool: Whether the capsule services were restarted
+    """
+    try:
+        # Update the template once 1829115 gets fixed.
+        result = await run_on(cap_host, WORKAROUND_1829115)
+        if result.exit_status != 0:
+            logger.warn(f"Failed to update the file on capsule {cap_host}")
+        result = await run_on(cap_host, FOREMAN_SERVICE_RESTART)
+    except (asyncssh.Error, OSError) as ex:
+        logger.error(f'Unable to connect to the Capsule {cap_host}: {ex}')
+        return False
+    if result.exit_status != 0:
+        logger.error(f'Unable to re-start the Capsule {cap_host} Services')
+        return False
+    return True
 
 
 def satellite_capsule_setup(satellite_host, capsule_hosts, os_version,
@@ -49,22 +88,28 @@ def satellite_capsule_setup(satellite_host, capsule_hosts, os_version,
     else:
         logger.warning('No OS Specified. Terminating..')
         sys.exit(1)
-    non_responsive_host = []
-    for cap_host in capsule_hosts:
-        if not host_pings(cap_host):
-            non_responsive_host.append(cap_host)
-        else:
-            execute(host_ssh_availability_check, cap_host)
-        # Update the template once 1829115 gets fixed.
-        execute(workaround_1829115, host=cap_host)
-        if not bz_bug_is_open(1829115):
-            logger.warn("Please update the capsule template for fixed capsule version")
-        execute(foreman_service_restart, host=cap_host)
-        if non_responsive_host:
-            logger.warning(str(non_responsive_host) + ' these are '
-                                                      'non-responsive hosts')
-            sys.exit(1)
-        copy_ssh_key(satellite_host, capsule_hosts)
+    cache_dns_resolution()
+    # Probe all the capsules at once and before any remote task
+    with ThreadPoolExecutor(max_workers=min(len(capsule_hosts), 16)) as executor:
+        pings = list(executor.map(partial(host_pings, timeout=1), capsule_hosts))
+        responsive_hosts = [
+            cap_host for cap_host, responsive in zip(capsule_hosts, pings) if responsive]
+        ssh_checks = list(executor.map(host_ssh_availability_check, responsive_hosts))
+    non_responsive_host = [cap_host for cap_host in capsule_hosts
+                           if cap_host not in responsive_hosts]
+    non_responsive_host += [
+        cap_host for cap_host, available in zip(responsive_hosts, ssh_checks) if not available]
+    if non_responsive_host:
+        logger.warning(str(non_responsive_host) + ' these are '
+                                                  'non-responsive hosts')
+        sys.exit(1)
+    # The pre-upgrade tasks of all the capsules run at once in a single event loop
+    if not all(run_on_hosts(_setup_one_capsule, capsule_hosts)):
+        sys.exit(1)
+    if not bz_bug_is_open(1829115):
+        logger.warn("Please update the capsule template for fixed capsule version")
+    # The key is copied to all the capsules at once
+    copy_ssh_key(satellite_host, capsule_hosts)
     if upgradable_capsule:
         if settings.upgrade.distribution == "cdn":
             settings.repos.capsule_repo = None
@@ -75,7 +120,6 @@ def satellite_capsule_setup(satellite_host, capsule_hosts, os_version,
             http_proxy_config(capsule_hosts)
         execute(sync_capsule_repos_to_satellite, capsule_hosts, host=satellite_host)
         for cap_host in capsule_hosts:
-            settings.upgrade.capsule_hostname = cap_host
             execute(add_baseOS_repo, baseurl, host=cap_host)
             execute(yum_repos_cleanup, host=cap_host)
             logger.info(f'Capsule {cap_host} is ready for Upgrade')
@@ -104,37 +148,30 @@ def satellite_capsule_upgrade(cap_host, sat_host):
 
     """
     logger.highlight('\n========== CAPSULE UPGRADE =================\n')
-    # Check the capsule sync before upgrade.
-    logger.info("Check the capsule sync after satellite upgrade to verify sync operation "
-                "with n-1 combination")
-    execute(capsule_sync, cap_host, host=sat_host)
-    wait_untill_capsule_sync(cap_host)
     from_version = settings.upgrade.from_version
     to_version = settings.upgrade.to_version
+    os_version = settings.upgrade.os
+    distribution = settings.upgrade.distribution
     setup_capsule_firewall()
-    major_ver = settings.upgrade.os[-1]
-    ak_name = settings.upgrade.capsule_ak[settings.upgrade.os]
+    major_ver = os_version[-1]
+    ak_name = settings.upgrade.capsule_ak[os_version]
     run(f'subscription-manager register --org="Default_Organization" '
-        f'--activationkey={ak_name} --force')
+        f'--activationkey={ak_name} --force && subscription-manager repos --list')
     logger.info(f"Activation key {ak_name} registered capsule's all available repository")
-    run("subscription-manager repos --list")
-    maintenance_repo = [RHEL_CONTENTS["maintenance"]["label"]]
-    capsule_repos = [
-        RHEL_CONTENTS["tools"]["label"],
-        RHEL_CONTENTS["capsule"]["label"],
-    ]
-    with fabric_settings(warn_only=True):
-        if settings.upgrade.distribution == "cdn":
-            enable_disable_repo(enable_repos_name=capsule_repos + maintenance_repo)
-        else:
-            enable_disable_repo(disable_repos_name=maintenance_repo)
-
+    enable_repos_name = [_ansible_repo(major_ver, settings.upgrade.ansible_repo_version)]
+    disable_repos_name = []
+    if distribution == "cdn":
+        enable_repos_name += _MAINTENANCE_REPOS
+        # The capsule repos of the current version are disabled for the major upgrade
+        if from_version == to_version:
+            enable_repos_name += _CAPSULE_REPOS
+    else:
+        disable_repos_name += _MAINTENANCE_REPOS
     if from_version != to_version:
-        with fabric_settings(warn_only=True):
-            enable_disable_repo(disable_repos_name=capsule_repos)
+        disable_repos_name += _CAPSULE_REPOS
     with fabric_settings(warn_only=True):
-        enable_disable_repo(enable_repos_name=[
-            f"rhel-{major_ver}-server-ansible-{settings.upgrade.ansible_repo_version}-rpms"])
+        enable_disable_repo(disable_repos_name=disable_repos_name,
+                            enable_repos_name=enable_repos_name)
 
     if settings.upgrade.foreman_maintain_capsule_upgrade:
         foreman_maintain_package_update()
@@ -144,14 +181,10 @@ def satellite_capsule_upgrade(cap_host, sat_host):
                       cap_host=cap_host,
                       sat_host=sat_host)
     # Rebooting the capsule for kernel update if any
-    reboot(160)
-    host_ssh_availability_check(cap_host)
+    if not reboot(600, cap_host):
+        sys.exit(1)
     # Check if Capsule upgrade is success
     upgrade_validation()
-    # Check the capsule sync after upgrade.
-    logger.info("check the capsule sync after capsule upgrade")
-    execute(capsule_sync, cap_host, host=sat_host)
-    wait_untill_capsule_sync(cap_host)
 
 
 def satellite_capsule_zstream_upgrade(cap_host):
@@ -170,29 +203,25 @@ def satellite_capsule_zstream_upgrade(cap_host):
     logger.highlight('\n========== CAPSULE UPGRADE =================\n')
     from_version = settings.upgrade.from_version
     to_version = settings.upgrade.to_version
+    os_version = settings.upgrade.os
+    distribution = settings.upgrade.distribution
     if not from_version == to_version:
         logger.warning('zStream Upgrade on Capsule cannot be performed as '
                        'FROM and TO versions are not same!')
         sys.exit(1)
-    major_ver = settings.upgrade.os[-1]
-    ak_name = settings.upgrade.capsule_ak[settings.upgrade.os]
+    major_ver = os_version[-1]
+    ak_name = settings.upgrade.capsule_ak[os_version]
     run(f'subscription-manager register --org="Default_Organization" '
-        f'--activationkey={ak_name} --force')
+        f'--activationkey={ak_name} --force && subscription-manager repos --list')
     logger.info(f"Activation key {ak_name} registered capsule's all available repository")
-    run("subscription-manager repos --list")
-    capsule_repos = [
-        RHEL_CONTENTS["tools"]["label"],
-        RHEL_CONTENTS["capsule"]["label"],
-        RHEL_CONTENTS["maintenance"]["label"]
-    ]
+    capsule_repos = _CAPSULE_REPOS + _MAINTENANCE_REPOS
+    ansible_repos = [_ansible_repo(major_ver, settings.upgrade.ansible_repo_version)]
     with fabric_settings(warn_only=True):
-        if settings.upgrade.distribution == "cdn":
-            enable_disable_repo(enable_repos_name=capsule_repos)
+        if distribution == "cdn":
+            enable_disable_repo(enable_repos_name=[*capsule_repos, *ansible_repos])
         else:
-            enable_disable_repo(disable_repos_name=capsule_repos)
-        ansible_repos = [f"rhel-{major_ver}-server-ansible-"
-                         f"{settings.upgrade.ansible_repo_version}-rpms"]
-        enable_disable_repo(enable_repos_name=ansible_repos)
+            enable_disable_repo(disable_repos_name=capsule_repos,
+                                enable_repos_name=ansible_repos)
     # Check what repos are set
     # setup_foreman_maintain_repo()
     if settings.upgrade.foreman_maintain_capsule_upgrade:
@@ -201,7 +230,9 @@ def satellite_capsule_zstream_upgrade(cap_host):
         nonfm_upgrade(satellite_upgrade=False)
     # Rebooting the capsule for kernel update if any
     if settings.upgrade.satellite_capsule_setup_reboot:
-        reboot(160)
-    host_ssh_availability_check(cap_host)
+        if not reboot(600, cap_host):
+            sys.exit(1)
+    else:
+        host_ssh_availability_check(cap_host)
     # Check if Capsule upgrade is success
     upgrade_validation()
@@ -10,12 +10,12 @@ from upgrade.helpers import settings
 from upgrade.helpers.docker import docker_execute_command
 from upgrade.helpers.docker import generate_satellite_docker_clients_on_rhevm
 from upgrade.helpers.docker import refresh_subscriptions_on_docker_clients
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
 from upgrade.helpers.tasks import puppet_autosign_hosts
 from upgrade.helpers.tasks import sync_tools_repos_to_upgrade
 from upgrade.helpers.tools import version_filter
 
-logger = logger()
+logger = get_logger()
 
 
 def satellite6_client_setup():
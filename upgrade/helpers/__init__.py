@@ -1,7 +1,9 @@
 import os
 
+import requests
 from dynaconf import Dynaconf
 from nailgun.config import ServerConfig
+from requests.adapters import HTTPAdapter
 
 
 """
@@ -10,7 +12,18 @@ all the nailgun API's
 """
 
 sat_url = f"https://{os.environ.get('satellite_hostname')}"
-ServerConfig(url=sat_url, auth=['admin', 'changeme'], verify=False).save()
+sat_auth = ('admin', 'changeme')
+sat_verify = False
+ServerConfig(url=sat_url, auth=sat_auth, verify=sat_verify).save()
+
+"""
+The satellite API session for the requests made outside of nailgun, its pooled
+keep-alive connections are reused by all the API calls of the upgrade run
+"""
+sat_session = requests.Session()
+sat_session.auth = sat_auth
+sat_session.verify = sat_verify
+sat_session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20))
 
 """
 The dynaconf object use to access the environment variable
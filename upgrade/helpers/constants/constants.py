@@ -104,3 +104,10 @@ CAPSULE_SUBSCRIPTIONS = {
 DEFAULT_LOCATION = "Default Location"
 DEFAULT_ORGANIZATION = "Default Organization"
 DEFAULT_ORGANIZATION_LABEL = "Default_Organization"
+
+
+# Restores the original katello hostname-change script, update it once 1829115 gets fixed
+WORKAROUND_1829115 = (
+    "if [ -f /usr/share/katello/hostname-change.rb.backup ]; then "
+    "mv /usr/share/katello/hostname-change.rb.backup /usr/share/katello/hostname-change.rb; fi")
+FOREMAN_SERVICE_RESTART = 'foreman-maintain service restart'
@@ -7,9 +7,9 @@ from fabric.api import run
 from fauxfactory import gen_string
 
 from upgrade.helpers import settings
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
 
-logger = logger()
+logger = get_logger()
 
 
 def generate_satellite_docker_clients_on_rhevm(
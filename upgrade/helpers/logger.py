@@ -1,5 +1,6 @@
 import logging
 import os
+from functools import lru_cache
 
 HIGHLIGHT_LEVEL_NUM = 25
 logging.addLevelName(HIGHLIGHT_LEVEL_NUM, 'HIGHLIGHT')
@@ -32,9 +33,12 @@ class SingleLevelClassFilter(logging.Filter):
             return (record.levelno == self.level)
 
 
-def logger():
+@lru_cache(maxsize=1)
+def get_logger():
     """Logger to log messages to Console and to files
 
+    The logger is set up once, every later call returns the same object.
+
     This logger creates two files:
     full_upgrade: Contents all logging level logs
     upgrade_highlights: Contents only Highlight logging level logs
@@ -8,12 +8,12 @@ from fabric.api import execute
 from fabric.api import run
 
 from upgrade.helpers import settings
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
 from upgrade.helpers.tasks import get_osp_hostname
 from upgrade.helpers.tools import host_pings
 from upgrade.helpers.tools import host_ssh_availability_check
 
-logger = logger()
+logger = get_logger()
 
 # Toggle Debug logging
 shade.simple_logging(debug=True)
@@ -11,14 +11,14 @@ from ovirtsdk4 import ConnectionBuilder
 from ovirtsdk4 import types
 
 from upgrade.helpers import settings
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
 from upgrade.helpers.tasks import capsule_sync
 from upgrade.helpers.tasks import check_necessary_env_variables_for_upgrade
 from upgrade.helpers.tasks import check_ntpd
 from upgrade.helpers.tasks import foreman_service_restart
 
 
-logger = logger()
+logger = get_logger()
 
 
 def get_rhevm4_client():
@@ -4,10 +4,13 @@ Many commands are affected by environment variables. Unless stated otherwise,
 all environment variables are required.
 """
 import os
+import random
 import re
 import socket
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
@@ -17,7 +20,6 @@ from automation_tools import setup_capsule_firewall
 from automation_tools import setup_fake_manifest_certificate
 from automation_tools import setup_foreman_discovery
 from automation_tools import setup_rhv_ca
-from automation_tools.repository import disable_repos
 from automation_tools.repository import enable_repos
 from automation_tools.satellite6.capsule import generate_capsule_certs
 from automation_tools.utils import get_discovery_image
@@ -31,19 +33,24 @@ from fabric.api import warn_only
 from fabric.context_managers import shell_env
 from fauxfactory import gen_string
 from nailgun import entities
-from robozilla.decorators import bz_bug_is_open
+from nailgun.entity_mixins import TaskFailedError
+from nailgun.entity_mixins import TaskTimedOutError
 
+from upgrade.helpers import sat_session
+from upgrade.helpers import sat_url
 from upgrade.helpers import settings
 from upgrade.helpers.constants.constants import CAPSULE_SUBSCRIPTIONS
 from upgrade.helpers.constants.constants import CUSTOM_CONTENTS
 from upgrade.helpers.constants.constants import DEFAULT_LOCATION
 from upgrade.helpers.constants.constants import DEFAULT_ORGANIZATION
 from upgrade.helpers.constants.constants import DEFAULT_ORGANIZATION_LABEL
+from upgrade.helpers.constants.constants import FOREMAN_SERVICE_RESTART
 from upgrade.helpers.constants.constants import RHEL_CONTENTS
 from upgrade.helpers.docker import (
     attach_subscription_to_host_from_content_host
 )
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
+from upgrade.helpers.tools import bz_bug_is_open
 from upgrade.helpers.tools import call_entity_method_with_timeout
 from upgrade.helpers.tools import host_pings
 if sys.version_info[0] == 2:
@@ -51,7 +58,7 @@ if sys.version_info[0] == 2:
 else:  # pylint:disable=F0401,E0611
     from io import StringIO
 
-logger = logger()
+logger = get_logger()
 
 
 class ProductNotFound(Exception):
@@ -836,9 +843,82 @@ def capsule_sync(cap_host):
     job_execution_time("Capsule content sync operation", start_time)
 
 
+def capsule_sync_async(cap_host):
+    """Starts the Capsule Sync without waiting for it to finish
+
+    :param str cap_host: Capsule hostname to perform sync
+    :returns str: The id of the capsule sync foreman task, None if the sync
+        could not be started
+    """
+    capsule = entities.SmartProxy().search(
+        query={'search': f'name={cap_host}'})[0]
+    capsule.refresh()
+    logger.info(f'Running Capsule sync for capsule host {cap_host}')
+    capsule = entities.Capsule().search(
+        query={'search': f'name={cap_host}'})[0]
+    try:
+        return capsule.content_sync(synchronous=False)['id']
+    except Exception as ex:
+        logger.critical(ex)
+
+
+def wait_capsule_syncs(task_ids, timeout=9000, raise_on_failure=False):
+    """Waits for the capsule sync tasks to finish, the tasks are polled all at once
+
+    Each task is polled with an exponential backoff capped at 30 seconds plus a
+    random jitter, so the syncs of several capsules are not polled in lockstep.
+    A failed poll request is retried until the timeout. With raise_on_failure the
+    first failed or timed out task stops the polling of the other tasks.
+
+    :param list task_ids: The ids of the capsule sync foreman tasks, the None ids
+        of the syncs that failed to start are skipped
+    :param int timeout: The polling timeout of each task in seconds
+    :param bool raise_on_failure: Raise when a task fails or times out instead of
+        logging it
+    """
+    stop = threading.Event()
+
+    def _failed(error, message, task_id):
+        if raise_on_failure:
+            stop.set()
+            raise error(message, task_id)
+        logger.critical(message)
+
+    def _wait_capsule_sync(task_id):
+        timeup = time.time() + timeout
+        delay = 2
+        while time.time() < timeup:
+            if stop.is_set():
+                return
+            try:
+                response = sat_session.get(f'{sat_url}/foreman_tasks/api/tasks/{task_id}')
+                response.raise_for_status()
+                task = response.json()
+            except requests.exceptions.RequestException as ex:
+                logger.warning(f"Failed to poll capsule sync task {task_id}, retrying: {ex}")
+            else:
+                if task['state'] in ('paused', 'stopped'):
+                    if task['result'] != 'success':
+                        _failed(TaskFailedError, f"Capsule sync task {task_id} finished "
+                                f"with result {task['result']}", task_id)
+                    return
+            stop.wait(delay + random.uniform(0, 2))
+            delay = min(delay * 2, 30)
+        _failed(TaskTimedOutError, f"Capsule sync task {task_id} did not finish in "
+                f"{timeout} seconds", task_id)
+
+    task_ids = [task_id for task_id in task_ids if task_id is not None]
+    if not task_ids:
+        return
+    start_time = job_execution_time("Capsule content sync operation")
+    with ThreadPoolExecutor(max_workers=min(len(task_ids), 16)) as executor:
+        list(executor.map(_wait_capsule_sync, task_ids))
+    job_execution_time("Capsule content sync operation", start_time)
+
+
 def foreman_service_restart():
     """Restarts the foreman-maintain services"""
-    services = run('foreman-maintain service restart')
+    services = run(FOREMAN_SERVICE_RESTART)
     if services.return_code > 0:
         logger.error('Unable to re-start the Satellite Services')
         sys.exit(1)
@@ -1099,26 +1179,34 @@ def puppet_autosign_hosts(version, hosts, append=True):
         run('echo "{0}" {1} {2}'.format(host, append, puppetfile[puppetver]))
 
 
-def wait_untill_capsule_sync(capsule):
-    """The polling function that waits for capsule sync task to finish
+def _capsule_active_sync_tasks(capsule):
+    """Returns the ids of the sync tasks running on the capsule
 
     :param capsule: A capsule hostname
     """
     cap = entities.Capsule().search(
         query={'search': f'name={capsule}'})[0]
-    logger.info(f"Waiting for capsule {capsule} sync to finish ...")
-    active_tasks = cap.content_get_sync()['active_sync_tasks']
-    logger.info(f"Active tasks {active_tasks}")
-    if len(active_tasks) >= 1:
-        logger.info(
-            'Wait for background capsule sync to finish on '
-            'capsule: {}'.format(cap.name))
-        start_time = job_execution_time("capsule_sync")
-        for task in active_tasks:
-            entities.ForemanTask(id=task['id']).poll(timeout=9000)
-        job_execution_time("Background capsule sync operation(In past time-out value was "
-                           "2700 but in current execution we have set it 9000)",
-                           start_time)
+    response = sat_session.get(f'{sat_url}/katello/api/capsules/{cap.id}/content/sync')
+    response.raise_for_status()
+    active_tasks = response.json()['active_sync_tasks']
+    logger.info(f"Active tasks {active_tasks} on capsule {capsule}")
+    return [task['id'] for task in active_tasks]
+
+
+def wait_untill_capsule_sync(*capsules):
+    """The polling function that waits for capsule sync tasks to finish
+
+    The active sync tasks of all the capsules are waited for at once.
+
+    :param capsules: The capsule hostnames
+    """
+    logger.info(f"Waiting for capsules {', '.join(capsules)} sync to finish ...")
+    task_ids = [task_id for capsule in capsules
+                for task_id in _capsule_active_sync_tasks(capsule)]
+    if task_ids:
+        logger.info('Wait for background capsule sync to finish on '
+                    'capsules: {}'.format(', '.join(capsules)))
+        wait_capsule_syncs(task_ids, raise_on_failure=True)
 
 
 def pre_upgrade_system_checks(capsules):
@@ -1128,8 +1216,7 @@ def pre_upgrade_system_checks(capsules):
     """
     # Check and wait if the capsule sync task is running before upgrade
     if capsules:
-        for capsule in capsules:
-            wait_untill_capsule_sync(capsule)
+        wait_untill_capsule_sync(*capsules)
 
 
 def generate_custom_certs():
@@ -1201,6 +1288,18 @@ def check_status_of_running_task(command, attempt):
                     f"tasks running status")
 
 
+def _repository_content(repository, repository_name, base_url, enable, gpgcheck):
+    """Returns the yum .repo file content of the repository
+
+    See `repository_setup` for the params description.
+    """
+    return (f'[{repository}]\n'
+            f'name=s{repository_name}\n'
+            f'baseurl={base_url}\n'
+            f'enabled={enable}\n'
+            f'gpgcheck={gpgcheck}\n')
+
+
 def repository_setup(repository, repository_name, base_url, enable, gpgcheck):
     """
     This is generic fucntion which is used to setup the repository
@@ -1212,29 +1311,47 @@ def repository_setup(repository, repository_name, base_url, enable, gpgcheck):
     :return:
     """
     satellite_repo = StringIO()
-    satellite_repo.write(f'[{repository}]\n')
-    satellite_repo.write(f'name=s{repository_name}\n')
-    satellite_repo.write(f'baseurl={base_url}\n')
-    satellite_repo.write(f'enabled={enable}\n')
-    satellite_repo.write(f'gpgcheck={gpgcheck}\n')
+    satellite_repo.write(
+        _repository_content(repository, repository_name, base_url, enable, gpgcheck))
     put(local_path=satellite_repo,
         remote_path=f'/etc/yum.repos.d/{repository}.repo')
     satellite_repo.close()
 
 
+def repository_setup_many(repositories):
+    """
+    Sets up several repositories with a single remote command, each one in its
+    own /etc/yum.repos.d/<repository>.repo file like `repository_setup` does.
+    :param list repositories: dicts with the repository, repository_name,
+    base_url, enable and gpg keys e.g the CUSTOM_SAT_REPO values
+    """
+    repo_files = []
+    for repo in repositories:
+        content = _repository_content(repo["repository"], repo["repository_name"],
+                                      repo["base_url"], repo["enable"], repo["gpg"])
+        repo_files.append(
+            f"cat > /etc/yum.repos.d/{repo['repository']}.repo <<'EOF'\n{content}EOF")
+    # set -e fails the run on any repo file write, not only on the last one
+    run("\n".join(["set -e"] + repo_files))
+
+
 def enable_disable_repo(disable_repos_name=None, enable_repos_name=None):
     """
     The purpose of this function is to enable and disable the
-    repository as per requirements.
+    repository as per requirements. Both lists are applied by a single
+    subscription-manager call, the repositories are disabled first and then
+    enabled, so e.g. disable "*" followed by the required enables works.
     :param list disable_repos_name: This will take the
     list of repository which you are going to disable
     :param list enable_repos_name: This will take the list of
     repository which you are going to enable
     """
-    if disable_repos_name:
-        [disable_repos(f'{repo}', silent=True) for repo in disable_repos_name]
-    if enable_repos_name:
-        [enable_repos(f'{repo}') for repo in enable_repos_name]
+    repos_options = [f"--disable='{repo}'" for repo in disable_repos_name or []]
+    repos_options += [f"--enable='{repo}'" for repo in enable_repos_name or []]
+    if repos_options:
+        # The disable only calls are silent as the repositories may not exist
+        run(f"subscription-manager repos {' '.join(repos_options)}",
+            warn_only=not enable_repos_name)
 
 
 def nonfm_upgrade(satellite_upgrade=True,
@@ -1316,7 +1433,7 @@ def upgrade_validation(upgrade_type=False):
         if result.return_code != 0:
             logger.warn(result)
     if bz_bug_is_open(1860444) and not upgrade_type:
-        run('foreman-maintain service restart', warn_only=True)
+        run(FOREMAN_SERVICE_RESTART, warn_only=True)
 
 
 def update_scap_content():
@@ -1465,18 +1582,6 @@ def yum_repos_cleanup():
             logger.warn(result)
 
 
-def workaround_1829115():
-    """
-    Replacing the /usr/share/katello/hostname-change.rb with their original file before
-    starting the upgrade.
-    """
-    file_name = "/usr/share/katello/hostname-change.rb"
-    file_backup = '/usr/share/katello/hostname-change.rb.backup'
-    output = run(f"if [ -f {file_backup} ]; then mv {file_backup} {file_name}; fi")
-    if output.return_code > 0:
-        logger.warn("Failed to update the file")
-
-
 def workaround_1967131(task_type="rollback"):
     """
     Use to apply the pulp migration workaround for 1967131
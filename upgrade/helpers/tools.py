@@ -3,34 +3,175 @@
 Many commands are affected by environment variables. Unless stated otherwise,
 all environment variables are required.
 """
+import asyncio
 import json
 import re
+import socket
 import subprocess
 import time
+from functools import lru_cache
 
+import asyncssh
+from fabric.api import env
 from fabric.api import execute
 from fabric.api import run
+from fabric.api import settings as fabric_settings
 from nailgun import entity_mixins
+from robozilla.decorators import bz_bug_is_open as _bz_bug_is_open
 
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
 
-logger = logger()
+logger = get_logger()
 
+# The status of a bug is treated as fixed for the run, repeated checks of the same
+# bug return the first answer instead of evaluating robozilla's cached bug again
+bz_bug_is_open = lru_cache(maxsize=128)(_bz_bug_is_open)
 
-def reboot(halt_time=300):
+# Seconds for which a resolved hostname address is reused
+DNS_CACHE_TTL = 600
+# getaddrinfo arguments with the time of the resolution and the resolved addresses
+_dns_cache = {}
+# Seconds for which a successful ssh availability check of a host is trusted
+SSH_CHECK_TTL = 30
+# Hostnames with the time of their last successful ssh availability check
+_ssh_available_hosts = {}
+# The asyncssh connections of the hosts, reused by run_on within one run_on_hosts
+_ssh_connections = {}
+
+
+def _boot_id():
+    """Returns the boot id of the current fabric host
+
+    :returns str: The boot id, None if it could not be read e.g. the host is
+        going down or is not up yet.
+    """
+    try:
+        with fabric_settings(abort_exception=RuntimeError):
+            result = run('cat /proc/sys/kernel/random/boot_id', quiet=True)
+    except Exception as e:
+        logger.info(e)
+        return None
+    return result if result.succeeded else None
+
+
+def reboot(halt_time=300, host=None):
     """Reboots the host.
 
-    Also halts the execution until reboots according to given time.
+    Also halts the execution until the host is back from the reboot with ssh up
+    and running, at most for the given time. The host is back only once it
+    reports a boot id different from the one before the reboot, so a host that
+    is slow to go down is not taken for a rebooted one. If the boot id before the
+    reboot could not be read, the host has to be seen going down instead.
 
-    :param int halt_time: Halt execution in seconds.
+    :param int halt_time: Maximum halt of the execution in seconds.
+    :param str host: Hostname of the rebooted host, defaults to the current
+        fabric host.
+    :returns bool: True if the host came back before the halt_time is over.
     """
-    halt_time = halt_time
+    host = host or env.host
+    _ssh_available_hosts.pop(host, None)
+    boot_id = _boot_id()
     logger.info('Rebooting the host, please wait .... ')
     try:
         run('reboot', warn_only=True)
     except Exception as e:
         logger.info(e)
-    time.sleep(halt_time)
+    timeup = time.time() + halt_time
+    if boot_id is None:
+        if not wait_for_host_down(host, timeout=halt_time):
+            logger.error(f'The host {host} did not go down for the reboot')
+            return False
+    else:
+        wait_for_host_down(host)
+    delay = 1
+    while time.time() < timeup:
+        if wait_for_host_up(host, timeout=timeup - time.time()):
+            new_boot_id = _boot_id()
+            if new_boot_id and new_boot_id != boot_id:
+                logger.info(f'The host {host} is back from reboot')
+                return True
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+    logger.error(f'The host {host} did not come back from reboot in {halt_time} seconds')
+    return False
+
+
+def _ssh_banner_received(host, port=22):
+    """Checks the ssh daemon of the host answers with its banner
+
+    :param str host: The IP or hostname of host.
+    :param int port: The ssh port of the host.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=5) as sock:
+            return sock.recv(4) == b'SSH-'
+    except OSError:
+        return False
+
+
+def wait_for_host_down(host, timeout=30):
+    """Waits for the host to stop answering on the ssh port, e.g. after reboot.
+
+    :param str host: The IP or hostname of host.
+    :param int timeout: The polling timeout in seconds.
+    :returns bool: True if the host went down before the timeout.
+    """
+    timeup = time.time() + timeout
+    while time.time() < timeup:
+        if not _ssh_banner_received(host):
+            return True
+        time.sleep(1)
+    logger.warning(f'The host {host} did not go down in {timeout} seconds')
+    return False
+
+
+def wait_for_host_up(host, timeout=300):
+    """Waits for the host to answer on the ssh port.
+
+    The polling interval starts at one second and backs off up to five seconds,
+    so the wait ends shortly after the host is back.
+
+    :param str host: The IP or hostname of host.
+    :param int timeout: The polling timeout in seconds.
+    :returns bool: True if the host has ssh up and running before the timeout.
+    """
+    timeup = time.time() + timeout
+    delay = 1
+    while time.time() < timeup:
+        if _ssh_banner_received(host):
+            logger.info(f'The host {host} is up with ssh running')
+            return True
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+    logger.warning(f'SSH timed out for host {host}')
+    return False
+
+
+def cache_dns_resolution(ttl=DNS_CACHE_TTL):
+    """Caches the hostname resolution of the whole process.
+
+    Every fabric connect and nailgun request resolves the satellite and capsule
+    hostnames again, this keeps the resolved addresses in memory for ttl seconds
+    so a re-provisioned host is resolved again after that. Calling it more than
+    once has no effect.
+
+    :param int ttl: Seconds for which a resolved address is reused.
+    """
+    if getattr(socket.getaddrinfo, 'cached', False):
+        return
+    resolve = socket.getaddrinfo
+
+    def getaddrinfo(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        resolved_at, addresses = _dns_cache.get(key, (0, None))
+        if time.time() - resolved_at < ttl:
+            return addresses
+        addresses = resolve(*args, **kwargs)
+        _dns_cache[key] = (time.time(), addresses)
+        return addresses
+
+    getaddrinfo.cached = True
+    socket.getaddrinfo = getaddrinfo
 
 
 def copy_ssh_key(from_host, to_hosts):
@@ -98,13 +239,59 @@ def host_pings(host, timeout=15, ip_addr=False):
             time.sleep(5)
 
 
+async def run_on(host, command):
+    """Runs the command on the host over the cached asyncssh connection of the host
+
+    The connection is opened with the user and the keys of the fabric env.
+
+    :param str host: The hostname to run the command on
+    :param str command: The shell command to run
+    :returns: The asyncssh.SSHCompletedProcess with the exit_status and the output
+    """
+    if host not in _ssh_connections:
+        _ssh_connections[host] = await asyncssh.connect(
+            host, username=env.user, password=env.password, known_hosts=None,
+            client_keys=env.key_filename or ())
+    return await _ssh_connections[host].run(command)
+
+
+def run_on_hosts(task, hosts):
+    """Runs the coroutine function for all the hosts at once in a single event loop
+
+    The asyncssh connections opened by the task are closed once all the hosts are
+    done.
+
+    :param task: The coroutine function called with each hostname
+    :param list hosts: The hostnames to run the task for
+    :returns list: The results of the task in the order of the hosts
+    """
+    async def _gather():
+        try:
+            return await asyncio.gather(*[task(host) for host in hosts])
+        finally:
+            for connection in _ssh_connections.values():
+                connection.close()
+                await connection.wait_closed()
+            _ssh_connections.clear()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_gather())
+    finally:
+        loop.close()
+
+
 def host_ssh_availability_check(host, timeout=7):
     """This ensures the given host has ssh up and running.
 
+    The check is skipped if the host passed it in the last SSH_CHECK_TTL seconds.
+
     :param host: A string. The IP or hostname of host.
     :param int timeout: The polling timeout in minutes.
 
     """
+    if time.time() - _ssh_available_hosts.get(host, 0) < SSH_CHECK_TTL:
+        return True
     _, ip = host_pings(host, timeout=timeout, ip_addr=True)
     timeup = time.time() + int(timeout) * 60
     while True:
@@ -121,6 +308,7 @@ def host_ssh_availability_check(host, timeout=7):
             logger.warning('SSH timed out for host {0} '.format(host))
             return False
         if output.__contains__('seconds'):
+            _ssh_available_hosts[host] = time.time()
             return True
         else:
             time.sleep(5)
@@ -4,6 +4,7 @@ Many commands are affected by environment variables. Unless stated otherwise,
 all environment variables are required.
 """
 import sys
+from contextlib import ExitStack
 from distutils.version import LooseVersion
 
 from automation_tools import foreman_debug
@@ -17,10 +18,13 @@ from upgrade.capsule import satellite_capsule_zstream_upgrade
 from upgrade.client import satellite6_client_setup
 from upgrade.client import satellite6_client_upgrade
 from upgrade.helpers import settings
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
+from upgrade.helpers.tasks import capsule_sync_async
 from upgrade.helpers.tasks import check_necessary_env_variables_for_upgrade
 from upgrade.helpers.tasks import post_upgrade_test_tasks
 from upgrade.helpers.tasks import pre_upgrade_system_checks
+from upgrade.helpers.tasks import wait_capsule_syncs
+from upgrade.helpers.tools import cache_dns_resolution
 from upgrade.helpers.tools import create_setup_dict
 from upgrade.helpers.tools import get_sat_cap_version
 from upgrade.helpers.tools import get_setup_data
@@ -32,7 +36,21 @@ from upgrade.satellite import satellite_upgrade
 # Satellite, Capsule and Client Upgrade
 # =============================================================================
 
-logger = logger()
+logger = get_logger()
+
+
+def setup_fabric_env():
+    """Fabric env shared by the setup and upgrade tasks
+
+    Fabric caches a single ssh connection per host and reuses it for every
+    `execute`/`run`, the keepalive keeps that connection open across the long
+    quiet periods (installer, capsule sync polling) so it is not dropped and
+    re-established in between. The hostname resolution is cached for the run
+    as well.
+    """
+    env.disable_known_hosts = True
+    env.keepalive = 30
+    cache_dns_resolution()
 
 
 def product_setup_for_upgrade_on_brokers_machine(product, os_version, satellite, capsule=None):
@@ -46,7 +64,7 @@ def product_setup_for_upgrade_on_brokers_machine(product, os_version, satellite,
     """
     cap_hosts = None
     clients6 = clients7 = puppet_clients7 = puppet_clients6 = None
-    env.disable_known_hosts = True
+    setup_fabric_env()
     check_necessary_env_variables_for_upgrade(product)
 
     clients6 = clients7 = puppet_clients7 = puppet_clients6 = None
@@ -112,26 +130,47 @@ def product_upgrade(product, upgrade_type):
             raise
 
     def product_upgrade_capsule(cap_host):
+        current = execute(get_sat_cap_version, 'cap', host=cap_host)[cap_host]
+        if settings.upgrade.from_version != settings.upgrade.to_version:
+            execute(satellite_capsule_upgrade,
+                    cap_host, sat_host, host=cap_host)
+        elif settings.upgrade.from_version == settings.upgrade.to_version:
+            execute(satellite_capsule_zstream_upgrade,
+                    cap_host, host=cap_host)
+        upgraded = execute(
+            get_sat_cap_version, 'cap', host=cap_host)[cap_host]
+        check_upgrade_compatibility(upgrade_type, current, upgraded)
+
+    def product_upgrade_capsules(cap_hosts):
+        major_upgrade = settings.upgrade.from_version != settings.upgrade.to_version
         try:
-            with LogAnalyzer(cap_host):
-                current = execute(get_sat_cap_version, 'cap', host=cap_host)[cap_host]
-                if settings.upgrade.from_version != settings.upgrade.to_version:
-                    execute(satellite_capsule_upgrade,
-                            cap_host, sat_host, host=cap_host)
-                elif settings.upgrade.from_version == settings.upgrade.to_version:
-                    execute(satellite_capsule_zstream_upgrade,
-                            cap_host, host=cap_host)
-                upgraded = execute(
-                    get_sat_cap_version, 'cap', host=cap_host)[cap_host]
-                check_upgrade_compatibility(upgrade_type, current, upgraded)
+            with ExitStack() as log_analyzers:
+                for cap_host in cap_hosts:
+                    log_analyzers.enter_context(LogAnalyzer(cap_host))
+                # The capsule syncs are checked for all the capsules at once, before
+                # and after the capsules are upgraded one by one
+                if major_upgrade:
+                    logger.info("Check the capsule sync after satellite upgrade to verify "
+                                "sync operation with n-1 combination")
+                    wait_capsule_syncs(
+                        [capsule_sync_async(cap_host) for cap_host in cap_hosts])
+                for cap_host in cap_hosts:
+                    settings.upgrade.capsule_hostname = cap_host
+                    product_upgrade_capsule(cap_host)
+                if major_upgrade:
+                    logger.info("check the capsule sync after capsule upgrade")
+                    wait_capsule_syncs(
+                        [capsule_sync_async(cap_host) for cap_host in cap_hosts])
                 # Generate foreman debug on capsule postupgrade
-                execute(foreman_debug, f'capsule_{cap_host}', host=cap_host)
-                # Execute tasks as post upgrade tier1 tests
-                # are dependent
+                for cap_host in cap_hosts:
+                    execute(foreman_debug, f'capsule_{cap_host}', host=cap_host)
+            # Execute tasks as post upgrade tier1 tests are dependent
             if product == 'longrun':
-                post_upgrade_test_tasks(sat_host, cap_host)
+                for cap_host in cap_hosts:
+                    post_upgrade_test_tasks(sat_host, cap_host)
         except Exception:
-            execute(foreman_debug, f'capsule_{cap_host}', host=cap_host)
+            for cap_host in cap_hosts:
+                execute(foreman_debug, f'capsule_{cap_host}', host=cap_host)
             raise
 
     def product_upgrade_client():
@@ -146,7 +185,7 @@ def product_upgrade(product, upgrade_type):
         satellite6_client_upgrade(
             'rhel6', puppet_clients6, puppet=True)
 
-    env.disable_known_hosts = True
+    setup_fabric_env()
     check_necessary_env_variables_for_upgrade(product)
     logger.info(f'Performing UPGRADE FROM {settings.upgrade.from_version} TO '
                 f'{settings.upgrade.to_version}')
@@ -161,9 +200,7 @@ def product_upgrade(product, upgrade_type):
         product_upgrade_satellite(sat_host)
     elif (product == 'capsule' or product == 'longrun')\
             and upgrade_type == 'capsule':
-        for cap_host in cap_hosts:
-            settings.upgrade.capsule_hostname = cap_host
-            product_upgrade_capsule(cap_host)
+        product_upgrade_capsules(cap_hosts)
     elif (product == 'client' or product == 'longrun') and upgrade_type == 'client':
         product_upgrade_client()
 
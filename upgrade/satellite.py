@@ -9,28 +9,29 @@ from automation_tools.utils import update_packages
 from fabric.api import env
 from fabric.api import execute
 from fabric.api import run
-from robozilla.decorators import bz_bug_is_open
 
 from upgrade.helpers import settings
 from upgrade.helpers.constants.constants import CUSTOM_SAT_REPO
 from upgrade.helpers.constants.constants import RHEL_CONTENTS
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
 from upgrade.helpers.tasks import enable_disable_repo
 from upgrade.helpers.tasks import foreman_maintain_package_update
 from upgrade.helpers.tasks import foreman_packages_installation_check
 from upgrade.helpers.tasks import foreman_service_restart
 from upgrade.helpers.tasks import nonfm_upgrade
 from upgrade.helpers.tasks import pulp2_pulp3_migration
-from upgrade.helpers.tasks import repository_setup
+from upgrade.helpers.tasks import repository_setup_many
 from upgrade.helpers.tasks import setup_satellite_repo
 from upgrade.helpers.tasks import upgrade_using_foreman_maintain
 from upgrade.helpers.tasks import upgrade_validation
 from upgrade.helpers.tasks import workaround_1967131
 from upgrade.helpers.tasks import yum_repos_cleanup
+from upgrade.helpers.tools import bz_bug_is_open
+from upgrade.helpers.tools import cache_dns_resolution
 from upgrade.helpers.tools import host_ssh_availability_check
 from upgrade.helpers.tools import reboot
 
-logger = logger()
+logger = get_logger()
 
 
 def satellite_setup(satellite_host):
@@ -42,6 +43,7 @@ def satellite_setup(satellite_host):
     os.environ["RHN_USERNAME"] = settings.subscription.rhn_username
     os.environ["RHN_PASSWORD"] = settings.subscription.rhn_password
     os.environ["RHN_POOLID"] = settings.subscription.rhn_poolid
+    cache_dns_resolution()
     execute(host_ssh_availability_check, satellite_host)
     execute(yum_repos_cleanup, host=satellite_host)
     execute(install_prerequisites, host=satellite_host)
@@ -86,8 +88,12 @@ def satellite_upgrade(zstream=False):
 
     """
     logger.highlight('\n========== SATELLITE UPGRADE =================\n')
+    from_version = settings.upgrade.from_version
+    to_version = settings.upgrade.to_version
+    distribution = settings.upgrade.distribution
+    fm_upgrade = settings.upgrade.foreman_maintain_satellite_upgrade
     if zstream:
-        if not settings.upgrade.from_version == settings.upgrade.to_version:
+        if not from_version == to_version:
             logger.warning('zStream Upgrade on Satellite cannot be performed as '
                            'FROM and TO versions are not same!')
             sys.exit(1)
@@ -99,26 +105,19 @@ def satellite_upgrade(zstream=False):
     if settings.upgrade.downstream_fm_upgrade:
         settings.upgrade.whitelist_param = ", repositories-validate, repositories-setup"
 
-    # disable all the repos
-    enable_disable_repo(disable_repos_name=["*"])
-
+    enable_repos_name = []
     # It is required to enable the tools and server for non-fm upgrade because in
     # fm both the repos enabled by the fm tool.
-    if not settings.upgrade.foreman_maintain_satellite_upgrade:
-        enable_disable_repo(enable_repos_name=common_sat_cap_repos)
-    if settings.upgrade.distribution == 'cdn':
-        enable_disable_repo(enable_repos_name=['rhel-7-server-satellite-maintenance-6-rpms'])
-    else:
-        for repo in CUSTOM_SAT_REPO:
-            repository_setup(
-                CUSTOM_SAT_REPO[repo]["repository"],
-                CUSTOM_SAT_REPO[repo]["repository_name"],
-                CUSTOM_SAT_REPO[repo]["base_url"],
-                CUSTOM_SAT_REPO[repo]["enable"],
-                CUSTOM_SAT_REPO[repo]["gpg"]
-            )
+    if not fm_upgrade:
+        enable_repos_name += common_sat_cap_repos
+    if distribution == 'cdn':
+        enable_repos_name.append('rhel-7-server-satellite-maintenance-6-rpms')
+    # disable all the repos and enable only the required ones
+    enable_disable_repo(disable_repos_name=["*"], enable_repos_name=enable_repos_name)
+    if distribution != 'cdn':
+        repository_setup_many(CUSTOM_SAT_REPO.values())
         foreman_maintain_package_update()
-    if settings.upgrade.to_version == "6.10":
+    if to_version == "6.10":
         if bz_bug_is_open(1967131):
             workaround_1967131(task_type="apply")
         pulp_migration_status = pulp2_pulp3_migration()
@@ -127,7 +126,7 @@ def satellite_upgrade(zstream=False):
         if not pulp_migration_status:
             sys.exit(1)
 
-    if settings.upgrade.foreman_maintain_satellite_upgrade:
+    if fm_upgrade:
         preup_time = datetime.now().replace(microsecond=0)
         upgrade_using_foreman_maintain()
         postup_time = datetime.now().replace(microsecond=0)
@@ -145,14 +144,16 @@ def satellite_upgrade(zstream=False):
             foreman_maintain_package_update()
             update_packages(quiet=True)
 
-        if settings.upgrade.distribution == "cdn":
+        if distribution == "cdn":
             enable_disable_repo(enable_repos_name=[f'rhel-{major_ver}-server-satellite'
-                                                   f'-{settings.upgrade.to_version}-rpms'])
+                                                   f'-{to_version}-rpms'])
         nonfm_upgrade()
         foreman_packages_installation_check(state="lock")
     # Rebooting the satellite for kernel update if any
     if settings.upgrade.satellite_capsule_setup_reboot:
-        reboot(180)
-    host_ssh_availability_check(env.get('satellite_host'))
+        if not reboot(600, env.get('satellite_host')):
+            sys.exit(1)
+    else:
+        host_ssh_availability_check(env.get('satellite_host'))
     # Test the Upgrade is successful
     upgrade_validation(True)
@@ -11,7 +11,7 @@ from fabric.api import run
 
 from upgrade.helpers import settings
 from upgrade.helpers.docker import generate_satellite_docker_clients_on_rhevm
-from upgrade.helpers.logger import logger
+from upgrade.helpers.logger import get_logger
 from upgrade.helpers.rhevm4 import create_rhevm4_instance
 from upgrade.helpers.rhevm4 import get_rhevm4_client
 from upgrade.helpers.rhevm4 import wait_till_rhevm4_instance_status
@@ -19,7 +19,7 @@ from upgrade.helpers.rhevm4 import wait_till_rhevm4_instance_status
 rpm1 = 'https://inecas.fedorapeople.org/fakerepos/zoo3/bear-4.1-1.noarch.rpm'
 rpm2 = 'https://inecas.fedorapeople.org/fakerepos/zoo3/camel-0.1-1.noarch.rpm'
 
-logger = logger()
+logger = get_logger()
 
 
 def create_dict(entities_dict):